@@ -22,19 +22,35 @@ Usage:
 """
 
 import asyncio
+import hashlib
+import hmac
 import modal
 import os
-import shutil
+import queue
+import random
+import subprocess
 import time
 import uuid
+from collections import OrderedDict
 
-from shared import sandbox_image, setup_github_auth, clone_and_install, run_agent
+import orjson
+from cachetools import TTLCache
+
+from shared import (
+    sandbox_image, setup_github_auth, clone_and_install, run_agent,
+    repo_cache_volume, REPO_CACHE_DIR,
+)
 from models import (
-    db_volume, DB_DIR,
-    create_job, get_job, update_job, list_jobs, now_iso,
+    db_volume, DB_DIR, commit_db, reload_db, reload_if_stale, job_events,
+    publish_job_event,
+    get_job_epoch,
+    create_job, create_jobs_bulk, get_job, get_job_status, update_job,
+    update_job_async, list_jobs, list_job_summaries, now_iso,
+    append_job_logs, get_job_logs, MAX_RESULT_LOGS,
     create_pipeline, get_pipeline, list_pipelines, delete_pipeline,
     create_pipeline_run, get_pipeline_run, update_pipeline_run,
     list_pipeline_runs, get_jobs_for_run,
+    cleanup_old_jobs, maintain_db,
 )
 from scheduler import topological_sort, resolve_templates
 
@@ -51,7 +67,7 @@ app = modal.App("agent-api")
 # Lightweight image for API endpoints and pipeline orchestrator
 api_image = (
     modal.Image.debian_slim()
-    .pip_install("fastapi[standard]")
+    .pip_install("fastapi[standard]", "orjson", "uvloop", "httptools", "cachetools")
     .add_local_file("shared.py", "/root/shared.py")
     .add_local_file("models.py", "/root/models.py")
     .add_local_file("scheduler.py", "/root/scheduler.py")
@@ -64,13 +80,17 @@ api_image = (
 @app.function(
     image=sandbox_image,
     timeout=1800,
-    volumes={DB_DIR: db_volume},
+    volumes={DB_DIR: db_volume, REPO_CACHE_DIR: repo_cache_volume},
+    # One warm worker absorbs the cold start (boot + image pull + imports)
+    # for bursty webhook-driven submissions
+    min_containers=1,
+    max_containers=10,
     secrets=[
         modal.Secret.from_name("gemini-key", required_keys=["GEMINI_API_KEY"]),
         modal.Secret.from_name("github-token", required_keys=["GITHUB_TOKEN"]),
     ],
 )
-def run_agent_task(job_id: str, repo_url: str, task: str, github_token: str = ""):
+async def run_agent_task(job_id: str, repo_url: str, task: str, github_token: str = ""):
     """
     The heavy lifter — runs entirely in Modal cloud.
     Uses shared.py for auth, clone, install, and agent execution.
@@ -78,60 +98,78 @@ def run_agent_task(job_id: str, repo_url: str, task: str, github_token: str = ""
     """
     token = github_token or os.environ.get("GITHUB_TOKEN", "")
     all_logs = []
+    logs_written = 0  # how many of all_logs are already persisted as job_logs rows
 
     # Ensure we have the latest DB state (API container committed the job record)
-    db_volume.reload()
+    reload_db()
 
     job = get_job(job_id)
     if not job:
         raise RuntimeError(f"Job {job_id} not found in database after reload — possible volume sync issue")
 
-    update_job(job_id, status="running", started_at=now_iso())
-    db_volume.commit()
+    started_at = now_iso()
+    update_job_async(job_id, status="running", started_at=started_at)
+    commit_db()  # flushes the queued update before the volume commit
+    publish_job_event(job_id, {"status": "running", "started_at": started_at})
 
     last_error = None
     for attempt in range(1, MAX_ATTEMPTS + 1):
         try:
-            # Clean up workspace from previous attempt
-            if os.path.exists(WORKSPACE):
-                shutil.rmtree(WORKSPACE)
-
+            # Clean up workspace from previous attempt. Attempt 1 runs in
+            # a fresh container, so skip even the stat; native rm -rf beats
+            # Python's recursive unlink loop on node_modules-sized trees.
+            if attempt > 1:
+                subprocess.run(["rm", "-rf", WORKSPACE], check=False)
+
+            # One DB write per attempt; live phase progress travels over
+            # the event bus instead of per-phase update_job round trips.
             msg = f"[Attempt {attempt}/{MAX_ATTEMPTS}] Authenticating with GitHub..."
             all_logs.append(msg)
-            update_job(job_id, attempt=attempt, logs=all_logs)
+            logs_written = append_job_logs(job_id, all_logs[logs_written:])
+            update_job_async(job_id, attempt=attempt)
+            publish_job_event(job_id, {"status": "running", "new_logs": [msg], "log_offset": len(all_logs) - 1})
             setup_github_auth(token)
 
             msg = f"[Attempt {attempt}/{MAX_ATTEMPTS}] Cloning repository..."
             all_logs.append(msg)
-            update_job(job_id, logs=all_logs)
+            publish_job_event(job_id, {"status": "running", "new_logs": [msg], "log_offset": len(all_logs) - 1})
             clone_and_install(repo_url)
 
             msg = f"[Attempt {attempt}/{MAX_ATTEMPTS}] Agent engine starting..."
             all_logs.append(msg)
-            update_job(job_id, logs=all_logs)
+            publish_job_event(job_id, {"status": "running", "new_logs": [msg], "log_offset": len(all_logs) - 1})
             result = run_agent(task)
 
             # Merge agent log lines into accumulated logs
             all_logs.extend(result["log_lines"])
 
+            completed_at = now_iso()
+            job_result = {
+                "pr_url": result["pr_url"],
+                "summary": (
+                    f"Agent finished. PR: {result['pr_url']}"
+                    if result["pr_url"]
+                    else "Agent finished (no PR URL detected)."
+                ),
+                "exit_code": result["exit_code"],
+            }
+            logs_written = append_job_logs(job_id, all_logs[logs_written:])
             update_job(
                 job_id,
                 status="completed",
-                completed_at=now_iso(),
+                completed_at=completed_at,
                 attempt=attempt,
-                result={
-                    "pr_url": result["pr_url"],
-                    "summary": (
-                        f"Agent finished. PR: {result['pr_url']}"
-                        if result["pr_url"]
-                        else "Agent finished (no PR URL detected)."
-                    ),
-                    "exit_code": result["exit_code"],
-                },
-                logs=all_logs,
+                result=job_result,
             )
 
-            db_volume.commit()
+            commit_db()
+            publish_job_event(job_id, {
+                "status": "completed",
+                "completed_at": completed_at,
+                "result": job_result,
+                "new_logs": result["log_lines"],
+                "log_offset": len(all_logs) - len(result["log_lines"]),
+            })
             return {"status": "completed", "pr_url": result["pr_url"]}
 
         except Exception as exc:
@@ -139,30 +177,47 @@ def run_agent_task(job_id: str, repo_url: str, task: str, github_token: str = ""
             error_msg = str(exc)[:500]
 
             if attempt < MAX_ATTEMPTS:
-                delay = RETRY_BASE_DELAY * (2 ** (attempt - 1))
-                msg = f"[Attempt {attempt}/{MAX_ATTEMPTS}] Failed: {error_msg}. Retrying in {delay}s..."
+                # Full jitter: spread simultaneous retries across the
+                # backoff window instead of hammering the upstream in lockstep
+                delay = random.uniform(
+                    RETRY_BASE_DELAY, RETRY_BASE_DELAY * (2 ** attempt)
+                )
+                msg = f"[Attempt {attempt}/{MAX_ATTEMPTS}] Failed: {error_msg}. Retrying in {delay:.0f}s..."
                 all_logs.append(msg)
+                logs_written = append_job_logs(job_id, all_logs[logs_written:])
                 update_job(
                     job_id,
                     status="retrying",
                     attempt=attempt,
                     error=error_msg,
-                    logs=all_logs,
                 )
-                db_volume.commit()
-                time.sleep(delay)
+                commit_db()
+                publish_job_event(job_id, {
+                    "status": "retrying", "error": error_msg, "new_logs": [msg],
+                    "log_offset": len(all_logs) - 1,
+                })
+                await asyncio.sleep(delay)
             else:
                 msg = f"[Attempt {attempt}/{MAX_ATTEMPTS}] Failed: {error_msg}"
                 all_logs.append(msg)
+                completed_at = now_iso()
+                final_error = f"All {MAX_ATTEMPTS} attempts failed. Last error: {error_msg}"
+                logs_written = append_job_logs(job_id, all_logs[logs_written:])
                 update_job(
                     job_id,
                     status="failed",
-                    completed_at=now_iso(),
+                    completed_at=completed_at,
                     attempt=attempt,
-                    error=f"All {MAX_ATTEMPTS} attempts failed. Last error: {error_msg}",
-                    logs=all_logs,
+                    error=final_error,
                 )
-                db_volume.commit()
+                commit_db()
+                publish_job_event(job_id, {
+                    "status": "failed",
+                    "completed_at": completed_at,
+                    "error": final_error,
+                    "new_logs": [msg],
+                    "log_offset": len(all_logs) - 1,
+                })
                 raise last_error
 
 
@@ -173,13 +228,13 @@ def run_agent_task(job_id: str, repo_url: str, task: str, github_token: str = ""
 @app.function(
     image=sandbox_image,
     timeout=1800,
-    volumes={DB_DIR: db_volume},
+    volumes={REPO_CACHE_DIR: repo_cache_volume},
     secrets=[
         modal.Secret.from_name("gemini-key", required_keys=["GEMINI_API_KEY"]),
         modal.Secret.from_name("github-token", required_keys=["GITHUB_TOKEN"]),
     ],
 )
-def run_pipeline_step(
+async def run_pipeline_step(
     job_id: str,
     repo_url: str,
     task: str,
@@ -189,88 +244,128 @@ def run_pipeline_step(
     """
     Execute a single pipeline step. Similar to run_agent_task but passes
     step_context to the agent for upstream output awareness.
+
+    Unlike run_agent_task, this function never touches the shared SQLite
+    file: sibling steps in a layer run in parallel, and volume commits
+    are last-writer-wins per file, so each container committing its own
+    copy of agent.db would erase the others' records. Live progress
+    still travels over the event bus; the job updates and logs are
+    returned to the orchestrator, which persists the whole layer in a
+    single reload+commit.
     """
     token = github_token or os.environ.get("GITHUB_TOKEN", "")
     all_logs = []
 
-    db_volume.reload()
+    started_at = now_iso()
+    publish_job_event(job_id, {"status": "running", "started_at": started_at})
 
-    job = get_job(job_id)
-    if not job:
-        raise RuntimeError(f"Pipeline step job {job_id} not found after reload")
-
-    update_job(job_id, status="running", started_at=now_iso())
-    db_volume.commit()
-
-    last_error = None
     for attempt in range(1, MAX_ATTEMPTS + 1):
         try:
-            if os.path.exists(WORKSPACE):
-                shutil.rmtree(WORKSPACE)
+            if attempt > 1:
+                subprocess.run(["rm", "-rf", WORKSPACE], check=False)
 
             msg = f"[Step:{step_context.get('step_name', '?')}][Attempt {attempt}/{MAX_ATTEMPTS}] Authenticating..."
             all_logs.append(msg)
-            update_job(job_id, attempt=attempt, logs=all_logs)
+            publish_job_event(job_id, {"status": "running", "new_logs": [msg], "log_offset": len(all_logs) - 1})
             setup_github_auth(token)
 
             msg = f"[Step:{step_context.get('step_name', '?')}][Attempt {attempt}/{MAX_ATTEMPTS}] Cloning..."
             all_logs.append(msg)
-            update_job(job_id, logs=all_logs)
+            publish_job_event(job_id, {"status": "running", "new_logs": [msg], "log_offset": len(all_logs) - 1})
             clone_and_install(repo_url)
 
             msg = f"[Step:{step_context.get('step_name', '?')}][Attempt {attempt}/{MAX_ATTEMPTS}] Agent starting..."
             all_logs.append(msg)
-            update_job(job_id, logs=all_logs)
+            publish_job_event(job_id, {"status": "running", "new_logs": [msg], "log_offset": len(all_logs) - 1})
             result = run_agent(task, step_context=step_context)
 
             all_logs.extend(result["log_lines"])
 
-            update_job(
-                job_id,
-                status="completed",
-                completed_at=now_iso(),
-                attempt=attempt,
-                result={
-                    "pr_url": result["pr_url"],
-                    "summary": (
-                        f"Step completed. PR: {result['pr_url']}"
-                        if result["pr_url"]
-                        else "Step completed (no PR)."
-                    ),
-                    "exit_code": result["exit_code"],
-                },
-                step_output=result["step_output"],
-                logs=all_logs,
-            )
-
-            db_volume.commit()
-            return result["step_output"]
+            completed_at = now_iso()
+            job_result = {
+                "pr_url": result["pr_url"],
+                "summary": (
+                    f"Step completed. PR: {result['pr_url']}"
+                    if result["pr_url"]
+                    else "Step completed (no PR)."
+                ),
+                "exit_code": result["exit_code"],
+            }
+            publish_job_event(job_id, {
+                "status": "completed",
+                "completed_at": completed_at,
+                "result": job_result,
+                "new_logs": result["log_lines"],
+                "log_offset": len(all_logs) - len(result["log_lines"]),
+            })
+            return {
+                "status": "completed",
+                "started_at": started_at,
+                "completed_at": completed_at,
+                "attempt": attempt,
+                "result": job_result,
+                "step_output": result["step_output"],
+                "logs": all_logs,
+            }
 
         except Exception as exc:
-            last_error = exc
             error_msg = str(exc)[:500]
 
             if attempt < MAX_ATTEMPTS:
-                delay = RETRY_BASE_DELAY * (2 ** (attempt - 1))
-                msg = f"[Step:{step_context.get('step_name', '?')}][Attempt {attempt}] Failed: {error_msg}. Retrying in {delay}s..."
-                all_logs.append(msg)
-                update_job(
-                    job_id, status="retrying", attempt=attempt,
-                    error=error_msg, logs=all_logs,
+                # Full jitter: spread simultaneous retries across the
+                # backoff window instead of hammering the upstream in lockstep
+                delay = random.uniform(
+                    RETRY_BASE_DELAY, RETRY_BASE_DELAY * (2 ** attempt)
                 )
-                db_volume.commit()
-                time.sleep(delay)
+                msg = f"[Step:{step_context.get('step_name', '?')}][Attempt {attempt}] Failed: {error_msg}. Retrying in {delay:.0f}s..."
+                all_logs.append(msg)
+                publish_job_event(job_id, {
+                    "status": "retrying", "error": error_msg, "new_logs": [msg],
+                    "log_offset": len(all_logs) - 1,
+                })
+                await asyncio.sleep(delay)
             else:
                 msg = f"[Step:{step_context.get('step_name', '?')}][Attempt {attempt}] Failed: {error_msg}"
                 all_logs.append(msg)
-                update_job(
-                    job_id, status="failed", completed_at=now_iso(),
-                    attempt=attempt,
-                    error=f"All {MAX_ATTEMPTS} attempts failed. Last: {error_msg}",
-                    logs=all_logs,
-                )
-                db_volume.commit()
-                raise last_error
+                completed_at = now_iso()
+                final_error = f"All {MAX_ATTEMPTS} attempts failed. Last: {error_msg}"
+                publish_job_event(job_id, {
+                    "status": "failed",
+                    "completed_at": completed_at,
+                    "error": final_error,
+                    "new_logs": [msg],
+                    "log_offset": len(all_logs) - 1,
+                })
+                return {
+                    "status": "failed",
+                    "started_at": started_at,
+                    "completed_at": completed_at,
+                    "attempt": attempt,
+                    "error": final_error,
+                    "logs": all_logs,
+                }
+
+
+# ---------------------------------------------------------------------------
+# 2b'. Scheduled database maintenance
+# ---------------------------------------------------------------------------
+
+@app.function(
+    image=api_image,
+    volumes={DB_DIR: db_volume},
+    schedule=modal.Period(days=1),
+)
+def db_maintenance():
+    """
+    Daily housekeeping: prune old terminal jobs, then checkpoint the WAL,
+    refresh planner statistics and run PRAGMA optimize so query plans
+    stay good as the data distribution shifts.
+    """
+    reload_db()
+    deleted = cleanup_old_jobs()
+    maintain_db()
+    commit_db()
+    print(f"[Maintenance] Deleted {deleted} old jobs; stats refreshed")
 
 
 # ---------------------------------------------------------------------------
@@ -288,23 +383,30 @@ def run_pipeline_task(
     repo_url: str,
     steps: list,
     github_token: str = "",
+    layers: list | None = None,
 ):
     """
     Orchestrate a full pipeline run: execute steps in DAG order,
     passing upstream outputs to downstream steps.
     """
-    db_volume.reload()
+    reload_db()
     try:
-        _execute_pipeline_steps(run_id, pipeline_id, repo_url, steps, github_token)
+        _execute_pipeline_steps(
+            run_id, pipeline_id, repo_url, steps, github_token, layers
+        )
     except Exception as exc:
-        # Catch-all: ensure the run never gets stuck in "running"
+        # Catch-all: ensure the run never gets stuck in "running".
+        # Re-pull the volume first — the local replica predates the step
+        # containers' commits, and volume commits are last-writer-wins
+        # per file, so committing it as-is would roll their records back.
+        reload_db()
         update_pipeline_run(
             run_id,
             status="failed",
             completed_at=now_iso(),
             error=f"Pipeline crashed: {str(exc)[:500]}",
         )
-        db_volume.commit()
+        commit_db()
         raise
 
 
@@ -314,29 +416,34 @@ def _execute_pipeline_steps(
     repo_url: str,
     steps: list,
     github_token: str,
+    layers: list | None = None,
 ):
     """Inner pipeline execution logic, wrapped by run_pipeline_task for safety."""
     update_pipeline_run(run_id, status="running", started_at=now_iso())
 
     step_map = {s["name"]: s for s in steps}
-    layers = topological_sort(steps)
+    if layers is None:
+        # Pipelines created before layers were persisted
+        layers = topological_sort(steps)
 
-    # Create job records for each step
+    # Create job records for each step in one batched insert
     job_ids: dict[str, str] = {}
+    job_rows = []
     for idx, step in enumerate(steps):
         job_id = str(uuid.uuid4())
-        create_job(
-            job_id=job_id,
-            repo_url=repo_url,
-            task=step["task"],
-            pipeline_id=pipeline_id,
-            run_id=run_id,
-            step_name=step["name"],
-            step_index=idx,
-        )
         job_ids[step["name"]] = job_id
-
-    db_volume.commit()
+        job_rows.append({
+            "job_id": job_id,
+            "repo_url": repo_url,
+            "task": step["task"],
+            "pipeline_id": pipeline_id,
+            "run_id": run_id,
+            "step_name": step["name"],
+            "step_index": idx,
+        })
+    create_jobs_bulk(job_rows)
+
+    commit_db()
 
     # Execute layer by layer
     step_outputs: dict[str, dict] = {}
@@ -344,7 +451,10 @@ def _execute_pipeline_steps(
 
     for layer in layers:
         if failed:
-            # Skip remaining layers
+            # Skip remaining layers. Reload first so the commit below
+            # doesn't upload a replica that predates other writers'
+            # commits (standalone jobs share the same volume).
+            reload_db()
             for step_name in layer:
                 jid = job_ids.get(step_name)
                 if jid:
@@ -353,14 +463,17 @@ def _execute_pipeline_steps(
                         error="Skipped: upstream step failed",
                         completed_at=now_iso(),
                     )
-            db_volume.commit()
+            commit_db()
             continue
 
+        # Dispatch every step in the layer at once — topological_sort
+        # groups steps into layers precisely because they are independent,
+        # and each step runs in its own container with its own workspace.
+        calls = {}
         for step_name in layer:
             step_def = step_map[step_name]
-            jid = job_ids[step_name]
 
-            # Resolve template variables
+            # Resolve template variables (upstream layers are complete)
             resolved_task = resolve_templates(step_def["task"], step_outputs)
 
             step_context = {
@@ -370,81 +483,192 @@ def _execute_pipeline_steps(
                 "upstream_outputs": step_outputs,
             }
 
-            on_failure = step_def.get("on_failure", "stop")
+            calls[step_name] = run_pipeline_step.spawn(
+                job_ids[step_name], repo_url, resolved_task, step_context,
+                github_token,
+            )
 
+        # Collect results; the layer now costs its slowest step, not the
+        # sum. Steps report success or failure in their return value —
+        # .get() only raises on infrastructure failure (container crash,
+        # hard timeout), in which case the step never got to report and
+        # its record is synthesized here.
+        results: dict[str, dict] = {}
+        for step_name, call in calls.items():
             try:
-                # Run the step synchronously (it's already in a Modal function)
-                step_result = run_pipeline_step.remote(
-                    jid, repo_url, resolved_task, step_context, github_token,
-                )
-
-                # Reload volume to see the step's DB writes
-                db_volume.reload()
-
-                if step_result:
-                    step_outputs[step_name] = step_result
-                else:
-                    step_outputs[step_name] = {"exit_code": 0}
-
-                # Verify the job didn't fail
-                updated_job = get_job(jid)
-                if updated_job and updated_job.get("status") == "failed":
-                    raise RuntimeError(updated_job.get("error", "Step failed"))
-
+                results[step_name] = call.get()
             except Exception as exc:
-                step_outputs[step_name] = {"error": str(exc)[:500]}
+                results[step_name] = {
+                    "status": "failed",
+                    "completed_at": now_iso(),
+                    "error": f"Step crashed: {str(exc)[:500]}",
+                    "logs": [],
+                }
+
+        # Persist the whole layer with one reload+commit. The steps
+        # themselves never write the shared DB: parallel siblings each
+        # committing their own copy of the file would race, and the last
+        # commit would erase the others' records.
+        reload_db()
+        for step_name, res in results.items():
+            logs = res.pop("logs", [])
+            if logs:
+                append_job_logs(job_ids[step_name], logs)
+            update_job(
+                job_ids[step_name],
+                **{k: v for k, v in res.items() if v is not None},
+            )
 
-                if on_failure == "stop":
+            if res["status"] == "completed":
+                step_outputs[step_name] = res.get("step_output") or {"exit_code": 0}
+            else:
+                error_msg = res.get("error", "step failed")
+                step_outputs[step_name] = {"error": error_msg}
+                if step_map[step_name].get("on_failure", "stop") == "stop":
                     failed = True
                     update_pipeline_run(
                         run_id,
-                        error=f"Step '{step_name}' failed: {str(exc)[:500]}",
+                        error=f"Step '{step_name}' failed: {error_msg}",
                     )
-                    db_volume.commit()
-                    break
+        commit_db()
 
-    # Finalize the run
+    # Finalize the run, again reloading first so the commit carries the
+    # latest volume state rather than rolling back whatever standalone
+    # jobs committed while the last layer was running.
+    reload_db()
     final_status = "failed" if failed else "completed"
     update_pipeline_run(run_id, status=final_status, completed_at=now_iso())
-    db_volume.commit()
+    commit_db()
 
 
 # ---------------------------------------------------------------------------
 # 3. HTTP API — FastAPI app with CORS and WebSocket
 # ---------------------------------------------------------------------------
 
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi import (
+    APIRouter, Depends, FastAPI, HTTPException, Request, Response,
+    WebSocket, WebSocketDisconnect,
+)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from starlette.websockets import WebSocketState
 
-web_app = FastAPI(title="Agent API")
+# uvloop roughly halves event-loop overhead for the WS/SSE pumps. It is
+# only installed in the API image; agent-task containers import this module
+# too, so fall back silently to the default loop there.
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
+web_app = FastAPI(title="Agent API", default_response_class=ORJSONResponse)
 
+# Pinned method/header lists let the middleware use precomputed sets
+# instead of wildcard validation per request; max_age keeps browsers
+# from re-sending the OPTIONS preflight for a day.
 web_app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "DELETE"],
+    allow_headers=["X-API-Key", "Content-Type", "If-None-Match"],
+    max_age=86400,
 )
 
+# Log-heavy payloads (/result, /jobs) are repetitive text that compresses
+# 5-10x; clients without Accept-Encoding: gzip get the raw bytes.
+web_app.add_middleware(GZipMiddleware, minimum_size=512)
+
+
+class _SSEIdentityEncoding:
+    """
+    Strip Accept-Encoding for the SSE route so GZipMiddleware leaves it
+    alone. Starlette gzips streaming responses regardless of
+    minimum_size, and EventSource always sends Accept-Encoding: gzip —
+    small `data:` frames would then sit in the zlib buffer until a block
+    fills, stalling live updates and heartbeats.
+
+    Added after GZipMiddleware so it runs before it on the request path.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/stream/"):
+            scope = dict(scope)
+            scope["headers"] = [
+                (k, v) for k, v in scope["headers"] if k != b"accept-encoding"
+            ]
+        await self.app(scope, receive, send)
+
+
+web_app.add_middleware(_SSEIdentityEncoding)
+
+# Optional API-key gate: deploy with API_KEY set to require an X-API-Key
+# header on non-public routes (the api function forwards it into the
+# container via a Modal Secret — see api() below). The key is read once
+# at import instead of per request, and compared with compare_digest to
+# avoid timing leaks. When API_KEY is unset the gate is a no-op.
+_EXPECTED_KEY = os.environ.get("API_KEY", "")
+
+
+def verify_api_key(request: Request) -> None:
+    """Reject the request unless it carries the configured API key."""
+    if not _EXPECTED_KEY:
+        return
+    provided = request.headers.get("x-api-key", "")
+    if not hmac.compare_digest(provided, _EXPECTED_KEY):
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+
+
+# Public routes (the health check, plus /ws and /stream which do their
+# own key checks — see ws_job and ep_stream_job) skip the auth dependency
+# entirely instead of re-checking the path on every request.
+public = APIRouter()
+protected = APIRouter(dependencies=[Depends(verify_api_key)])
+
 
 # ---------------------------------------------------------------------------
 # 3a. Endpoints
 # ---------------------------------------------------------------------------
 
-@web_app.get("/health")
+@public.get("/health")
 def ep_health():
-    return {"status": "ok", "timestamp": now_iso()}
+    # Hit by load-balancer probes; serve pre-encoded bytes with no store
+    # access or timestamp formatting.
+    return Response(content=_HEALTH_BODY, media_type="application/json")
+
+
+_HEALTH_BODY = orjson.dumps({"status": "ok"})
 
 
-@web_app.post("/submit")
+MAX_SUBMIT_BODY = 64_000  # bytes — submit payloads are tiny; cap parse cost
+
+
+@protected.post("/submit")
 async def ep_submit(request: Request):
-    body = await request.json()
+    try:
+        declared = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        declared = 0
+    if declared > MAX_SUBMIT_BODY:
+        return ORJSONResponse({"error": "Request body too large."}, status_code=413)
+
+    raw = await request.body()
+    if len(raw) > MAX_SUBMIT_BODY:
+        return ORJSONResponse({"error": "Request body too large."}, status_code=413)
+    try:
+        body = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return ORJSONResponse({"error": "Invalid JSON body."}, status_code=400)
 
     repo_url = body.get("repo_url")
     task = body.get("task")
     if not repo_url or not task:
-        return JSONResponse(
+        return ORJSONResponse(
             {"error": "Both 'repo_url' and 'task' are required."},
             status_code=400,
         )
@@ -452,9 +676,10 @@ async def ep_submit(request: Request):
     github_token = body.get("github_token", "")
     user_id = body.get("user_id", "anonymous")
 
-    job_id = str(uuid.uuid4())
+    # .hex skips the dashed-string formatting path — same 128 bits of entropy
+    job_id = uuid.uuid4().hex
     record = create_job(job_id, repo_url, task, user_id)
-    db_volume.commit()  # ensure the spawned container can see this job
+    commit_db()  # ensure the spawned container can see this job
 
     # Fire and forget — the task runs in the background
     run_agent_task.spawn(job_id, repo_url, task, github_token)
@@ -466,30 +691,62 @@ async def ep_submit(request: Request):
     }
 
 
-@web_app.get("/status/{job_id}")
-def ep_status(job_id: str):
-    db_volume.reload()
-    record = get_job(job_id)
-    if not record:
-        return JSONResponse({"error": f"Job '{job_id}' not found."}, status_code=404)
-
-    return {
-        "job_id": record["job_id"],
-        "status": record["status"],
-        "submitted_at": record["submitted_at"],
-        "started_at": record.get("started_at"),
-        "completed_at": record.get("completed_at"),
-    }
+# Completed/failed jobs never change, so their response payloads are cached
+# and later polls skip the volume reload and SQLite read entirely. Bounded
+# FIFO eviction keeps memory flat on long-lived containers. The bounds are
+# sized to the entries: status payloads are a handful of scalars, while a
+# result payload embeds up to MAX_RESULT_LOGS log lines — hundreds of KB
+# each, so 10k of those could run to gigabytes.
+_STATUS_CACHE_MAX = 10_000
+_RESULT_CACHE_MAX = 100
+_status_cache: OrderedDict = OrderedDict()
+_result_cache: OrderedDict = OrderedDict()
+
+
+def _cache_terminal(
+    cache: OrderedDict, job_id: str, payload: dict, limit: int
+) -> None:
+    cache[job_id] = payload
+    if len(cache) > limit:
+        cache.popitem(last=False)
+
+
+@protected.get("/status/{job_id}")
+def ep_status(job_id: str, request: Request):
+    payload = _status_cache.get(job_id)
+    if payload is None:
+        reload_if_stale()
+        payload = get_job_status(job_id)
+        if not payload:
+            return ORJSONResponse(
+                {"error": f"Job '{job_id}' not found."}, status_code=404
+            )
+        if payload["status"] in ("completed", "failed"):
+            _cache_terminal(_status_cache, job_id, payload, _STATUS_CACHE_MAX)
+
+    # Status only changes on transitions, so polls in a steady phase
+    # (e.g. a long "running" stretch) collapse into 304s.
+    etag = (
+        f'"{payload["status"]}-'
+        f'{payload["completed_at"] or payload["started_at"] or payload["submitted_at"]}"'
+    )
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return ORJSONResponse(payload, headers={"ETag": etag})
 
 
-@web_app.get("/result/{job_id}")
+@protected.get("/result/{job_id}")
 def ep_result(job_id: str):
-    db_volume.reload()
+    cached = _result_cache.get(job_id)
+    if cached is not None:
+        return cached
+
+    reload_if_stale()
     record = get_job(job_id)
     if not record:
-        return JSONResponse({"error": f"Job '{job_id}' not found."}, status_code=404)
+        return ORJSONResponse({"error": f"Job '{job_id}' not found."}, status_code=404)
 
-    return {
+    payload = {
         "job_id": record["job_id"],
         "status": record["status"],
         "repo_url": record["repo_url"],
@@ -502,34 +759,65 @@ def ep_result(job_id: str):
         "error": record.get("error"),
         "logs": record.get("logs", []),
     }
+    if record["status"] in ("completed", "failed"):
+        _cache_terminal(_result_cache, job_id, payload, _RESULT_CACHE_MAX)
+    return payload
 
 
-@web_app.get("/jobs")
-def ep_jobs():
-    """List all jobs, newest first. Returns summary (no logs)."""
-    db_volume.reload()
-    jobs = list_jobs()
-    return [
-        {
-            "job_id": j["job_id"],
-            "status": j["status"],
-            "repo_url": j["repo_url"],
-            "task": j["task"][:100],
-            "submitted_by": j.get("submitted_by", ""),
-            "submitted_at": j["submitted_at"],
-            "started_at": j.get("started_at"),
-            "completed_at": j.get("completed_at"),
-            "pr_url": (j.get("result") or {}).get("pr_url"),
-        }
-        for j in jobs
-    ]
+JOBS_CACHE_TTL = 1.0  # seconds — collapses N polling dashboards into 1 DB scan/s
+_jobs_cache: tuple[float, bytes, str] | None = None  # (expires_at, payload, etag)
+
+
+@protected.get("/result/{job_id}/logs")
+def ep_result_logs(job_id: str, from_seq: int = 0, limit: int = 500):
+    """
+    Page through a job's full log history.
+
+    /result/{job_id} embeds only the most recent MAX_RESULT_LOGS lines;
+    this endpoint serves arbitrary ranges by sequence number.
+    """
+    reload_if_stale()
+    limit = max(1, min(limit, MAX_RESULT_LOGS))
+    rows = get_job_logs(job_id, since_seq=from_seq, limit=limit)
+    if not rows and not get_job(job_id):
+        return ORJSONResponse({"error": f"Job '{job_id}' not found."}, status_code=404)
+    return {
+        "job_id": job_id,
+        "from_seq": from_seq,
+        "logs": rows,
+        "next_seq": (rows[-1]["seq"] + 1) if rows else from_seq,
+    }
+
+
+@protected.get("/jobs")
+def ep_jobs(request: Request):
+    """List all jobs, newest first. Returns summary (no logs).
+
+    The serialized payload is cached for JOBS_CACHE_TTL seconds and served
+    with an ETag, so polling clients get 304s instead of fresh DB scans.
+    """
+    global _jobs_cache
+
+    now = time.monotonic()
+    if _jobs_cache is None or now >= _jobs_cache[0]:
+        reload_db()
+        payload = orjson.dumps(list_job_summaries())
+        etag = hashlib.blake2b(payload, digest_size=8).hexdigest()
+        _jobs_cache = (now + JOBS_CACHE_TTL, payload, etag)
+
+    _, payload, etag = _jobs_cache
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(
+        content=payload, media_type="application/json", headers={"ETag": etag}
+    )
 
 
 # ---------------------------------------------------------------------------
 # 3b. Pipeline endpoints
 # ---------------------------------------------------------------------------
 
-@web_app.post("/pipelines")
+@protected.post("/pipelines")
 async def ep_create_pipeline(request: Request):
     """Create a new pipeline definition."""
     body = await request.json()
@@ -537,79 +825,101 @@ async def ep_create_pipeline(request: Request):
     name = body.get("name")
     steps = body.get("steps")
     if not name or not steps:
-        return JSONResponse(
+        return ORJSONResponse(
             {"error": "'name' and 'steps' are required."},
             status_code=400,
         )
 
-    # Validate each step
+    # Validate each step in a single pass
     seen_names = set()
     for i, step in enumerate(steps):
         if "name" not in step or "task" not in step:
-            return JSONResponse(
+            return ORJSONResponse(
                 {"error": f"Step {i} must have 'name' and 'task' fields."},
                 status_code=400,
             )
         if step["name"] in seen_names:
-            return JSONResponse(
+            return ORJSONResponse(
                 {"error": f"Duplicate step name: '{step['name']}'"},
                 status_code=400,
             )
         seen_names.add(step["name"])
 
-    # Validate DAG (no cycles, valid depends_on references)
+    # Validate DAG (no cycles, valid depends_on references). The sorted
+    # layers are persisted so runs never re-sort an immutable DAG.
     try:
-        topological_sort(steps)
+        layers = topological_sort(steps)
     except ValueError as e:
-        return JSONResponse({"error": str(e)}, status_code=400)
+        return ORJSONResponse({"error": str(e)}, status_code=400)
 
     pipeline_id = str(uuid.uuid4())
     repo_url = body.get("repo_url", "")
 
-    record = create_pipeline(pipeline_id, name, repo_url, steps)
-    db_volume.commit()
+    record = create_pipeline(pipeline_id, name, repo_url, steps, layers)
+    commit_db()
+    _pipelines_cache.clear()
     return record
 
 
-@web_app.get("/pipelines")
+# Pipeline definitions are immutable after create, but creates/deletes can
+# land on any autoscaled API container — a process-local invalidation
+# generation would leave every other container serving a stale listing (or
+# a cached 404) for its whole lifetime. Expire by time instead, like the
+# runs cache below; writes additionally clear the local cache so the
+# container that performed them reads its own write immediately.
+_pipelines_cache: TTLCache = TTLCache(maxsize=256, ttl=2.0)
+
+
+@protected.get("/pipelines")
 def ep_list_pipelines():
     """List all pipeline definitions."""
-    db_volume.reload()
-    return list_pipelines()
+    listing = _pipelines_cache.get(("list",))
+    if listing is None:
+        reload_if_stale()
+        listing = list_pipelines()
+        _pipelines_cache[("list",)] = listing
+    return listing
 
 
-@web_app.get("/pipelines/{pipeline_id}")
+@protected.get("/pipelines/{pipeline_id}")
 def ep_get_pipeline(pipeline_id: str):
     """Get a pipeline definition by ID."""
-    db_volume.reload()
-    record = get_pipeline(pipeline_id)
+    record = _pipelines_cache.get(("get", pipeline_id))
+    if record is None:
+        reload_if_stale()
+        record = get_pipeline(pipeline_id)
+        if record is not None:
+            # Misses are never cached — a pipeline created elsewhere must
+            # not 404 here until the entry happens to expire.
+            _pipelines_cache[("get", pipeline_id)] = record
     if not record:
-        return JSONResponse(
+        return ORJSONResponse(
             {"error": f"Pipeline '{pipeline_id}' not found."}, status_code=404
         )
     return record
 
 
-@web_app.delete("/pipelines/{pipeline_id}")
+@protected.delete("/pipelines/{pipeline_id}")
 def ep_delete_pipeline(pipeline_id: str):
     """Delete a pipeline definition."""
-    db_volume.reload()
+    reload_db()
     deleted = delete_pipeline(pipeline_id)
-    db_volume.commit()
+    commit_db()
+    _pipelines_cache.clear()
     if not deleted:
-        return JSONResponse(
+        return ORJSONResponse(
             {"error": f"Pipeline '{pipeline_id}' not found."}, status_code=404
         )
     return {"deleted": True}
 
 
-@web_app.post("/pipelines/{pipeline_id}/run")
+@protected.post("/pipelines/{pipeline_id}/run")
 async def ep_run_pipeline(pipeline_id: str, request: Request):
     """Trigger a pipeline execution."""
-    db_volume.reload()
+    reload_db()
     pipeline = get_pipeline(pipeline_id)
     if not pipeline:
-        return JSONResponse(
+        return ORJSONResponse(
             {"error": f"Pipeline '{pipeline_id}' not found."}, status_code=404
         )
 
@@ -621,18 +931,20 @@ async def ep_run_pipeline(pipeline_id: str, request: Request):
     github_token = body.get("github_token", "")
 
     if not repo_url:
-        return JSONResponse(
+        return ORJSONResponse(
             {"error": "No repo_url provided and pipeline has no default."},
             status_code=400,
         )
 
     run_id = str(uuid.uuid4())
     run = create_pipeline_run(run_id, pipeline_id, repo_url)
-    db_volume.commit()  # ensure the spawned container can see this run
+    commit_db()  # ensure the spawned container can see this run
+    _runs_cache.pop(pipeline_id, None)  # new run must show up immediately
 
     # Fire and forget — pipeline orchestrator runs in background
     run_pipeline_task.spawn(
         run_id, pipeline_id, repo_url, pipeline["steps"], github_token,
+        layers=pipeline.get("layers"),
     )
 
     return {
@@ -643,20 +955,36 @@ async def ep_run_pipeline(pipeline_id: str, request: Request):
     }
 
 
-@web_app.get("/pipelines/{pipeline_id}/runs")
+# Per-pipeline run listings, expired by time rather than by version — runs
+# mutate from worker containers this process never sees, so staleness is
+# bounded by the TTL instead of an invalidation hook.
+_runs_cache: TTLCache = TTLCache(maxsize=1024, ttl=0.5)
+
+
+@protected.get("/pipelines/{pipeline_id}/runs")
 def ep_list_pipeline_runs(pipeline_id: str):
-    """List all runs for a pipeline."""
-    db_volume.reload()
-    return list_pipeline_runs(pipeline_id)
+    """List all runs for a pipeline.
+
+    Run lists change while pipelines execute, so unlike pipeline
+    definitions they only get a short TTL cache: a polling UI hitting
+    this every second shares one SQLite scan per half-second window.
+    """
+    cached = _runs_cache.get(pipeline_id)
+    if cached is not None:
+        return cached
+    reload_if_stale()
+    runs = list_pipeline_runs(pipeline_id)
+    _runs_cache[pipeline_id] = runs
+    return runs
 
 
-@web_app.get("/runs/{run_id}")
+@protected.get("/runs/{run_id}")
 def ep_get_run(run_id: str):
     """Get pipeline run details including all step jobs."""
-    db_volume.reload()
+    reload_if_stale()
     run = get_pipeline_run(run_id)
     if not run:
-        return JSONResponse(
+        return ORJSONResponse(
             {"error": f"Run '{run_id}' not found."}, status_code=404
         )
 
@@ -683,37 +1011,143 @@ def ep_get_run(run_id: str):
 # 3c. WebSocket — real-time job updates
 # ---------------------------------------------------------------------------
 
-@web_app.websocket("/ws/{job_id}")
-async def ws_job(websocket: WebSocket, job_id: str):
-    """
-    Stream real-time updates for a specific job.
+WS_EVENT_TIMEOUT = 15  # seconds to wait for an event before re-checking the DB
+WS_BATCH_MAX = 128     # max events coalesced into a single WS frame
 
-    Polls the database and pushes changes to the client whenever
-    the job status or logs change.  The connection closes automatically
-    when the job reaches a terminal state (completed/failed).
+
+def _job_state_digest(record: dict, total_logs: int) -> bytes:
     """
-    await websocket.accept()
+    Hash the client-visible job state so unchanged records can be
+    skipped without re-serializing a full update payload.
+    """
+    return hashlib.blake2b(
+        orjson.dumps({
+            "status": record["status"],
+            "result": record.get("result"),
+            "error": record.get("error"),
+            "total_logs": total_logs,
+        }),
+        digest_size=8,
+    ).digest()
 
-    last_status = None
-    last_log_count = 0
 
-    try:
-        while True:
-            # Reload volume to see latest writes from the agent task
-            db_volume.reload()
+async def _ws_send(websocket: WebSocket, payload: dict) -> None:
+    """Send a payload as an orjson-encoded binary frame (faster than send_json)."""
+    await websocket.send_bytes(orjson.dumps(payload))
+
+
+def _merge_job_events(events: list[dict], delivered: int) -> dict:
+    """
+    Coalesce a burst of job events into one update payload.
+
+    The queue is a consuming store, not pub/sub: events published before
+    this subscriber connected are still sitting in the partition, so a
+    client that already got a log snapshot from the database would see
+    those lines twice. Publishers stamp each batch with log_offset (the
+    job-wide index of its first line); lines at indexes below *delivered*
+    are dropped here. Scalar fields (status, timestamps, result, error)
+    take the latest value seen. Returns the merged payload plus
+    "log_total", the job-wide line count after these events, and "gap"
+    when an event's offset lies beyond the lines delivered so far —
+    meaning another subscriber consumed the intervening events and the
+    caller must backfill the missing range from the database.
+    """
+    merged: dict = {"new_logs": []}
+    total = delivered
+    for event in events:
+        lines = event.get("new_logs") or []
+        offset = event.get("log_offset")
+        if lines:
+            if offset is None:
+                # No offset (legacy event) — can't dedupe, pass through
+                merged["new_logs"].extend(lines)
+                total += len(lines)
+            elif offset > total:
+                # Never jump the cursor over lines this connection has
+                # not seen; flag the gap and let the caller re-sync.
+                merged["gap"] = True
+            elif offset + len(lines) > total:
+                # Skip the prefix we already delivered
+                merged["new_logs"].extend(lines[total - offset:])
+                total = offset + len(lines)
+        for key in ("status", "started_at", "completed_at", "result", "error"):
+            if event.get(key) is not None:
+                merged[key] = event[key]
+    merged["log_total"] = total
+    return merged
+
+
+async def _job_update_stream(job_id: str):
+    """
+    Yield update payloads for a job until it reaches a terminal state.
+
+    Sends one snapshot from the database, then awaits push events
+    published by the agent task (see publish_job_event) instead of
+    polling on a timer.  If no event arrives within WS_EVENT_TIMEOUT
+    seconds, the database is re-checked as a fallback so missed events
+    only delay an update rather than losing it.  Shared by the WebSocket
+    and SSE endpoints.
+    """
+    # Initial snapshot straight from the database. DB and volume calls
+    # are blocking, so run them on the threadpool to keep the event loop
+    # (and every other WS/SSE client) responsive.
+    await run_in_threadpool(reload_db)
+    record = await run_in_threadpool(get_job, job_id)
+    if not record:
+        yield {"error": f"Job '{job_id}' not found."}
+        return
+
+    current_logs = record.get("logs", [])
+    last_status = record["status"]
+    last_log_count = len(current_logs)
+    last_epoch = await run_in_threadpool(get_job_epoch, job_id)
+    last_digest = _job_state_digest(record, last_log_count)
+    yield {
+        "type": "update",
+        "job_id": job_id,
+        "status": last_status,
+        "started_at": record.get("started_at"),
+        "completed_at": record.get("completed_at"),
+        "result": record.get("result"),
+        "error": record.get("error"),
+        "new_logs": current_logs,
+        "total_logs": last_log_count,
+    }
 
-            record = get_job(job_id)
+    if last_status in ("completed", "failed"):
+        yield {"type": "done", "status": last_status}
+        return
+
+    while True:
+        try:
+            event = await job_events.get.aio(
+                partition=job_id, timeout=WS_EVENT_TIMEOUT
+            )
+        except queue.Empty:
+            # No event in a while — fall back to a DB check in case
+            # the publisher died or an event was dropped. The epoch
+            # marker is a cheap Dict read; skip the whole-volume reload
+            # when nothing has been published since we last looked.
+            epoch = await run_in_threadpool(get_job_epoch, job_id)
+            if last_epoch is not None and epoch == last_epoch:
+                # Nothing to report — emit a heartbeat so the transport
+                # notices dead peers and tears the stream down instead of
+                # keeping a half-open connection (and its task) forever.
+                yield {"type": "ping"}
+                continue
+            last_epoch = epoch
+
+            await run_in_threadpool(reload_db)
+            record = await run_in_threadpool(get_job, job_id)
             if not record:
-                await websocket.send_json({"error": f"Job '{job_id}' not found."})
-                break
+                yield {"error": f"Job '{job_id}' not found."}
+                return
 
             current_status = record["status"]
             current_logs = record.get("logs", [])
-
-            # Send update if something changed
-            if current_status != last_status or len(current_logs) != last_log_count:
-                new_logs = current_logs[last_log_count:]
-                await websocket.send_json({
+            digest = _job_state_digest(record, len(current_logs))
+            if digest != last_digest:
+                yield {
                     "type": "update",
                     "job_id": job_id,
                     "status": current_status,
@@ -721,19 +1155,107 @@ async def ws_job(websocket: WebSocket, job_id: str):
                     "completed_at": record.get("completed_at"),
                     "result": record.get("result"),
                     "error": record.get("error"),
-                    "new_logs": new_logs,
+                    "new_logs": current_logs[last_log_count:],
                     "total_logs": len(current_logs),
-                })
+                }
+                last_digest = digest
                 last_status = current_status
                 last_log_count = len(current_logs)
 
-            # Stop streaming on terminal states
             if current_status in ("completed", "failed"):
-                await websocket.send_json({"type": "done", "status": current_status})
-                break
+                yield {"type": "done", "status": current_status}
+                return
+            continue
+
+        # Drain whatever else is already queued so a burst of updates
+        # becomes one frame instead of one frame per event.
+        events = [event]
+        more = await job_events.get_many.aio(
+            WS_BATCH_MAX - 1, block=False, partition=job_id
+        )
+        events.extend(more)
+        merged = _merge_job_events(events, last_log_count)
+
+        new_logs = merged["new_logs"]
+        offset = last_log_count
+        last_log_count = merged["log_total"]
+
+        if merged.get("gap"):
+            # Another subscriber consumed part of the stream, so some
+            # lines never reached this connection. Backfill them from
+            # the database by sequence number; anything the publisher
+            # has not committed yet will flag a gap again on the next
+            # event (or arrive via the epoch fallback) rather than being
+            # skipped for good.
+            await run_in_threadpool(reload_db)
+            rows = await run_in_threadpool(get_job_logs, job_id, last_log_count)
+            if rows:
+                new_logs = new_logs + [r["line"] for r in rows]
+                last_log_count = rows[-1]["seq"] + 1
+
+        status_changed = (
+            merged.get("status") is not None and merged["status"] != last_status
+        )
+
+        if status_changed or merged.get("result") is not None or merged.get("error") is not None:
+            last_status = merged.get("status", last_status)
+            payload = {
+                "type": "update",
+                "job_id": job_id,
+                "status": last_status,
+                "new_logs": new_logs,
+                "total_logs": last_log_count,
+            }
+            # Coalesced events only carry the scalars that happened to be
+            # in the burst — omit the rest rather than sending nulls that
+            # would wipe fields the client already holds (e.g. a retry
+            # event clobbering started_at).
+            for key in ("started_at", "completed_at", "result", "error"):
+                if merged.get(key) is not None:
+                    payload[key] = merged[key]
+            yield payload
+        elif new_logs:
+            # Logs grew but nothing else changed — skip re-sending the
+            # status/result fields and ship just the new lines.
+            yield {
+                "type": "log",
+                "job_id": job_id,
+                "lines": new_logs,
+                "offset": offset,
+                "total_logs": last_log_count,
+            }
+
+        if last_status in ("completed", "failed"):
+            yield {"type": "done", "status": last_status}
+            return
+
+
+@public.websocket("/ws/{job_id}")
+async def ws_job(websocket: WebSocket, job_id: str):
+    """
+    Stream real-time updates for a specific job over WebSocket.
 
-            await asyncio.sleep(2)
+    The connection closes automatically when the job reaches a
+    terminal state (completed/failed).
 
+    This is the one job-data route that stays off the protected router:
+    browser WebSocket clients cannot set custom headers during the
+    handshake, so the X-API-Key gate would lock the dashboard out. The
+    key can be passed as an ?api_key= query parameter instead; when
+    API_KEY is set, connections without a valid key are rejected before
+    any job data is sent.
+    """
+    if _EXPECTED_KEY and not hmac.compare_digest(
+        websocket.query_params.get("api_key", ""), _EXPECTED_KEY
+    ):
+        await websocket.close(code=1008)  # policy violation
+        return
+
+    await websocket.accept()
+
+    try:
+        async for payload in _job_update_stream(job_id):
+            await _ws_send(websocket, payload)
     except WebSocketDisconnect:
         pass
     except Exception:
@@ -741,11 +1263,54 @@ async def ws_job(websocket: WebSocket, job_id: str):
             await websocket.close()
 
 
+@public.get("/stream/{job_id}")
+async def ep_stream_job(job_id: str, request: Request):
+    """
+    Stream job updates as Server-Sent Events.
+
+    The update flow here is strictly server→client, so SSE carries the
+    same payloads as /ws/{job_id} without the WebSocket upgrade and
+    framing overhead, and browsers reconnect automatically.
+
+    Like /ws, this sits off the protected router: browser EventSource
+    cannot set custom headers, so the key is accepted as either an
+    X-API-Key header or an ?api_key= query parameter.
+    """
+    if _EXPECTED_KEY:
+        provided = (
+            request.headers.get("x-api-key")
+            or request.query_params.get("api_key", "")
+        )
+        if not hmac.compare_digest(provided, _EXPECTED_KEY):
+            raise HTTPException(status_code=401, detail="Invalid or missing API key")
+
+    async def gen():
+        async for payload in _job_update_stream(job_id):
+            yield b"data: " + orjson.dumps(payload) + b"\n\n"
+
+    return StreamingResponse(gen(), media_type="text/event-stream")
+
+
+web_app.include_router(public)
+web_app.include_router(protected)
+
+
 # ---------------------------------------------------------------------------
 # Mount the FastAPI app onto a single Modal function
 # ---------------------------------------------------------------------------
 
-@app.function(image=api_image, volumes={DB_DIR: db_volume})
+@app.function(
+    image=api_image,
+    volumes={DB_DIR: db_volume},
+    # Optional auth: deploy with API_KEY set locally to enable the gate
+    # (same from_dict pattern as sandbox.py); left empty, the gate stays
+    # a no-op. Without a secret here the API_KEY read at import could
+    # never see a value inside the container.
+    secrets=[
+        modal.Secret.from_dict({"API_KEY": os.environ.get("API_KEY", "")})
+    ],
+)
+@modal.concurrent(max_inputs=100)
 @modal.asgi_app()
 def api():
     return web_app
@@ -123,22 +123,32 @@ export default function App() {
 
     setWsLogs([]);
     const ws = new WebSocket(`${WS_BASE}/ws/${jobId}`);
+    ws.binaryType = "arraybuffer"; // server sends orjson-encoded binary frames
     wsRef.current = ws;
 
     ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+      const raw = typeof event.data === "string"
+        ? event.data
+        : new TextDecoder().decode(event.data);
+      const data = JSON.parse(raw);
       if (data.type === "update") {
+        // Delta frames omit fields that didn't change; keep the previous
+        // value for anything absent or null instead of wiping it.
         setSelected(prev => prev ? {
           ...prev,
-          status: data.status,
-          started_at: data.started_at,
-          completed_at: data.completed_at,
-          result: data.result,
-          error: data.error,
+          status: data.status ?? prev.status,
+          started_at: data.started_at ?? prev.started_at,
+          completed_at: data.completed_at ?? prev.completed_at,
+          result: data.result ?? prev.result,
+          error: data.error ?? prev.error,
         } : prev);
         if (data.new_logs?.length > 0) {
           setWsLogs(prev => [...prev, ...data.new_logs]);
         }
+      } else if (data.type === "log") {
+        if (data.lines?.length > 0) {
+          setWsLogs(prev => [...prev, ...data.lines]);
+        }
       } else if (data.type === "done") {
         selectJobRef.current?.(jobId);
         fetchJobsRef.current?.();
@@ -5,14 +5,18 @@ Uses SQLite stored on a Modal Volume for persistence across deployments.
 Supports jobs, pipelines, pipeline runs, and scheduled tasks.
 """
 
-import json
+import functools
+import queue
 import sqlite3
 import os
+import threading
+import time
 from datetime import datetime, timezone
 from contextlib import contextmanager
 from typing import Optional
 
 import modal
+import orjson
 
 # ---------------------------------------------------------------------------
 # Modal Volume for persistent SQLite storage
@@ -22,6 +26,79 @@ db_volume = modal.Volume.from_name("agent-db", create_if_missing=True)
 DB_DIR = "/data"
 DB_PATH = os.path.join(DB_DIR, "agent.db")
 
+# Cross-container event bus for real-time job updates. Each job gets its own
+# partition so WebSocket subscribers only see events for the job they watch.
+job_events = modal.Queue.from_name("agent-job-events", create_if_missing=True)
+
+# Last-update markers per job. Reading a Dict entry is far cheaper than a
+# whole-volume reload, so pollers compare markers to decide whether a
+# reload is worth it at all.
+job_epochs = modal.Dict.from_name("agent-job-epochs", create_if_missing=True)
+
+
+def get_job_epoch(job_id: str) -> Optional[str]:
+    """Return the job's last-update marker, or None if never published."""
+    try:
+        return job_epochs.get(job_id)
+    except Exception:
+        return None
+
+
+def commit_db() -> None:
+    """
+    Persist local SQLite writes to the shared Volume.
+
+    All cross-container durability goes through this single seam so the
+    sync policy (or the backing store itself) can change in one place.
+    Flushes any queued background job updates first so they are included
+    in the commit.
+    """
+    flush_job_updates()
+    db_volume.commit()
+
+
+def reload_db() -> None:
+    """
+    Pull the latest Volume state written by other containers.
+
+    Closes the shared SQLite connection first — a Volume reload fails
+    if any file inside it is still open.
+    """
+    global _last_reload
+    close_db()
+    db_volume.reload()
+    _last_reload = time.monotonic()
+
+
+_last_reload = 0.0
+
+
+def reload_if_stale(ttl: float = 1.0) -> None:
+    """
+    Reload the Volume only if the last reload was more than *ttl* seconds ago.
+
+    Read endpoints hit reload_db() on every request; under load that means
+    a Volume round-trip (and a connection teardown) per request for data
+    that rarely changed in between. A short TTL keeps reads near-fresh
+    while letting bursts share one reload.
+    """
+    if time.monotonic() - _last_reload >= ttl:
+        reload_db()
+
+
+def publish_job_event(job_id: str, event: dict) -> None:
+    """
+    Publish a job update event for real-time subscribers (e.g. ws_job).
+
+    Delivery is best-effort: subscribers fall back to reading the database,
+    so a dropped event only delays an update rather than losing it.
+    """
+    try:
+        job_epochs[job_id] = now_iso()
+        job_events.put(event, partition=job_id)
+    except Exception as exc:
+        print(f"[Events] Failed to publish event for job {job_id}: {exc}")
+
 
 # ---------------------------------------------------------------------------
 # Schema
@@ -52,18 +129,55 @@ CREATE TABLE IF NOT EXISTS jobs (
     updated_at       TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
 );
 
+-- Append-only job logs: one row per line, so appending N new lines costs
+-- O(N) instead of rewriting the whole logs JSON blob on every update.
+CREATE TABLE IF NOT EXISTS job_logs (
+    job_id  TEXT NOT NULL,
+    seq     INTEGER NOT NULL,
+    ts      TEXT NOT NULL,
+    line    TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+
 CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
-CREATE INDEX IF NOT EXISTS idx_jobs_submitted_at ON jobs(submitted_at);
-CREATE INDEX IF NOT EXISTS idx_jobs_pipeline_id ON jobs(pipeline_id);
-CREATE INDEX IF NOT EXISTS idx_jobs_run_id ON jobs(run_id);
 CREATE INDEX IF NOT EXISTS idx_jobs_batch_id ON jobs(batch_id);
 
+-- Composite indexes matching the actual query shapes: get_jobs_for_run's
+-- WHERE run_id ORDER BY step_index becomes a no-sort range scan, and
+-- per-pipeline listings read newest-first without a sort step. These
+-- subsume the old single-column run_id/pipeline_id indexes, which are
+-- dropped below to cut write amplification.
+CREATE INDEX IF NOT EXISTS idx_jobs_run_step ON jobs(run_id, step_index);
+CREATE INDEX IF NOT EXISTS idx_jobs_pipeline_submitted ON jobs(pipeline_id, submitted_at DESC);
+DROP INDEX IF EXISTS idx_jobs_run_id;
+DROP INDEX IF EXISTS idx_jobs_pipeline_id;
+
+-- Partial index for cleanup_old_jobs: only terminal jobs qualify for
+-- deletion, so the index stays small and the DELETE scans candidates
+-- instead of the whole table.
+CREATE INDEX IF NOT EXISTS idx_jobs_cleanup ON jobs(completed_at)
+    WHERE status IN ('completed', 'failed');
+
+-- Expression index matching the /jobs summary projection exactly, so the
+-- listing scan is served from the index without touching the big task and
+-- result blobs in the table rows. The old single-column submitted_at
+-- index is dropped below: it is a prefix of this one, and as the
+-- narrower of the two the planner preferred it — with row lookups —
+-- leaving the covering index as pure write amplification.
+CREATE INDEX IF NOT EXISTS idx_jobs_list ON jobs(
+    submitted_at DESC, job_id, status, repo_url, substr(task, 1, 100),
+    submitted_by, started_at, completed_at,
+    json_extract(result_json, '$.pr_url')
+);
+DROP INDEX IF EXISTS idx_jobs_submitted_at;
+
 -- Pipeline definitions (reusable templates)
 CREATE TABLE IF NOT EXISTS pipelines (
     pipeline_id    TEXT PRIMARY KEY,
     name           TEXT NOT NULL,
     repo_url       TEXT,
     steps_json     TEXT NOT NULL DEFAULT '[]',
+    layers_json    TEXT,
     created_at     TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
     updated_at     TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
 );
@@ -81,8 +195,14 @@ CREATE TABLE IF NOT EXISTS pipeline_runs (
     updated_at     TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
 );
 
-CREATE INDEX IF NOT EXISTS idx_pipeline_runs_pipeline_id ON pipeline_runs(pipeline_id);
+-- list_pipeline_runs orders newest-first both with and without a
+-- pipeline filter; these match so neither branch needs a sort step.
+-- The composite subsumes the old single-column pipeline_id index.
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_pipeline_created
+    ON pipeline_runs(pipeline_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_created ON pipeline_runs(created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_pipeline_runs_status ON pipeline_runs(status);
+DROP INDEX IF EXISTS idx_pipeline_runs_pipeline_id;
 
 -- Scheduled tasks (Phase 3)
 CREATE TABLE IF NOT EXISTS schedules (
@@ -105,29 +225,183 @@ CREATE TABLE IF NOT EXISTS schedules (
 # Database connection management
 # ---------------------------------------------------------------------------
 
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=memory",
+    "PRAGMA cache_size=-65536",          # 64 MiB page cache
+    "PRAGMA mmap_size=268435456",        # 256 MiB — reads skip the syscall path
+    "PRAGMA wal_autocheckpoint=1000",    # bound WAL growth under write load
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
+
+_conn: Optional[sqlite3.Connection] = None
+_conn_lock = threading.Lock()
+
+# Read-only connection pool: with WAL, readers never block the writer and
+# vice versa, so reads can fan out across threads while mutations serialize
+# on the single writer connection above.
+#
+# Each reader is stamped with the database generation it was opened
+# against. close_db() bumps the generation; a reader that was checked out
+# across that close is discarded on return instead of being re-pooled as
+# a stale handle bound to the pre-reload file.
+_MAX_READERS = os.cpu_count() or 4
+_readers: "queue.Queue[tuple[int, sqlite3.Connection]]" = queue.Queue()
+_reader_count = 0  # readers alive: pooled + checked out
+_reader_lock = threading.Condition()
+_db_generation = 0
+
+
 def _init_db(conn: sqlite3.Connection) -> None:
     """Create tables and indexes if they don't exist."""
     conn.executescript(_SCHEMA)
+    # Columns added after the initial schema; ALTER TABLE errors if the
+    # column already exists, which is the common case.
+    try:
+        conn.execute("ALTER TABLE pipelines ADD COLUMN layers_json TEXT")
+    except sqlite3.OperationalError:
+        pass
     conn.commit()
 
 
-@contextmanager
-def get_db():
-    """Yield a SQLite connection with WAL mode and auto-commit on success."""
+# The schema script is idempotent but not free: executescript parses the
+# whole DDL text every time. The writer reconnects after every Volume
+# reload, so apply the schema once per process, not once per connect.
+_schema_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    """Open a connection with tuned PRAGMAs and the schema applied."""
+    global _schema_ready
     os.makedirs(DB_DIR, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    if not _schema_ready:
+        _init_db(conn)
+        _schema_ready = True
+    return conn
+
+
+def _connect_reader() -> sqlite3.Connection:
+    """Open a read-only connection against the existing database file."""
+    conn = sqlite3.connect(
+        f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False,
+        cached_statements=256,
+    )
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA foreign_keys=ON")
-    _init_db(conn)
+    conn.execute("PRAGMA query_only=ON")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA temp_store=memory")
+    return conn
+
+
+def _checkout_reader() -> tuple[int, sqlite3.Connection]:
+    """Borrow a (generation, reader) pair, growing the pool up to _MAX_READERS."""
+    global _conn, _reader_count
+
+    # The writer creates the DB file and schema; make sure it exists
+    # before a mode=ro open can succeed.
+    with _conn_lock:
+        if _conn is None:
+            _conn = _connect()
+
     try:
-        yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+        return _readers.get_nowait()
+    except queue.Empty:
+        pass
+
+    with _reader_lock:
+        if _reader_count < _MAX_READERS:
+            _reader_count += 1
+            return (_db_generation, _connect_reader())
+
+    return _readers.get()  # pool exhausted — wait for a reader to come back
+
+
+def _return_reader(gen: int, conn: sqlite3.Connection) -> None:
+    """Re-pool a reader, or close it if the database moved underneath it."""
+    global _reader_count
+    with _reader_lock:
+        if gen == _db_generation:
+            _readers.put((gen, conn))
+        else:
+            conn.close()
+            _reader_count -= 1
+            _reader_lock.notify_all()  # close_db may be waiting on this
+
+
+@contextmanager
+def get_db(readonly: bool = False):
+    """
+    Yield a shared per-container SQLite connection.
+
+    Mutations use the single writer connection, serialized by a lock with
+    commit on success and rollback on error.  Reads borrow a read-only
+    connection from a small pool so they never queue behind the writer.
+    """
+    global _conn
+
+    if readonly:
+        gen, conn = _checkout_reader()
+        try:
+            yield conn
+        finally:
+            _return_reader(gen, conn)
+        return
+
+    with _conn_lock:
+        if _conn is None:
+            _conn = _connect()
+        try:
+            yield _conn
+            _conn.commit()
+        except Exception:
+            _conn.rollback()
+            raise
+
+
+def close_db() -> None:
+    """Close all shared connections (required before a Volume reload)."""
+    global _conn, _reader_count, _db_generation
+    with _conn_lock:
+        if _conn is not None:
+            try:
+                # Let SQLite refresh planner stats before the handle goes away.
+                _conn.execute("PRAGMA optimize")
+            except sqlite3.Error:
+                pass
+            _conn.close()
+            _conn = None
+    with _reader_lock:
+        # From here on, returning readers close themselves instead of
+        # re-pooling (see _return_reader).
+        _db_generation += 1
+        while True:
+            try:
+                _, conn = _readers.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            _reader_count -= 1
+
+        # Readers checked out by in-flight requests still hold the file
+        # open, which would fail the upcoming Volume reload. Wait briefly
+        # for them to come back; each return closes the handle and wakes
+        # this loop. Don't wait forever — a wedged request shouldn't
+        # deadlock every reload, and the caller will surface the error.
+        deadline = time.monotonic() + 2.0
+        while _reader_count > 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"[DB] {_reader_count} reader(s) still checked out at close")
+                break
+            _reader_lock.wait(remaining)
 
 
 # ---------------------------------------------------------------------------
@@ -139,13 +413,28 @@ def now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def _row_to_dict(row: sqlite3.Row) -> dict:
-    """Convert a sqlite3.Row to a plain dict, deserialising JSON fields."""
+# Per-table row converters: each parses exactly the JSON columns its table
+# has, instead of probing every known *_json key on every row.
+
+def _job_row_to_dict(row: sqlite3.Row) -> dict:
+    """Convert a jobs row, deserialising its JSON columns."""
+    d = dict(row)
+    raw = d.pop("result_json")
+    d["result"] = orjson.loads(raw) if raw else None
+    raw = d.pop("logs_json")
+    d["logs"] = orjson.loads(raw) if raw else []
+    raw = d.pop("step_output_json")
+    d["step_output"] = orjson.loads(raw) if raw else None
+    return d
+
+
+def _pipeline_row_to_dict(row: sqlite3.Row) -> dict:
+    """Convert a pipelines row, deserialising its JSON columns."""
     d = dict(row)
-    for key in ("result_json", "logs_json", "steps_json", "repos_json", "step_output_json"):
-        if key in d:
-            clean_key = key.replace("_json", "") if key != "step_output_json" else "step_output"
-            d[clean_key] = json.loads(d.pop(key)) if d[key] else ([] if "logs" in key or "steps" in key or "repos" in key else None)
+    raw = d.pop("steps_json")
+    d["steps"] = orjson.loads(raw) if raw else []
+    raw = d.pop("layers_json")
+    d["layers"] = orjson.loads(raw) if raw else None
     return d
 
 
@@ -153,6 +442,10 @@ def _row_to_dict(row: sqlite3.Row) -> dict:
 # Job CRUD
 # ---------------------------------------------------------------------------
 
+# Cap on log lines embedded in a job record; older lines stay in job_logs
+# and are reachable through get_job_logs pagination.
+MAX_RESULT_LOGS = 2000
+
 def create_job(
     job_id: str,
     repo_url: str,
@@ -167,111 +460,356 @@ def create_job(
     """Insert a new job record and return it as a dict."""
     ts = now_iso()
     with get_db() as conn:
-        conn.execute(
+        row = conn.execute(
             """INSERT INTO jobs
                (job_id, repo_url, task, submitted_by, submitted_at,
                 pipeline_id, run_id, batch_id, step_name, step_index, logs_json)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '[]')""",
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '[]')
+               RETURNING *""",
             (job_id, repo_url, task, user_id, ts,
              pipeline_id, run_id, batch_id, step_name, step_index),
+        ).fetchone()
+    return _job_row_to_dict(row)
+
+
+def create_jobs_bulk(records: list[dict]) -> None:
+    """
+    Insert many job records in one transaction.
+
+    One write-lock acquisition and one commit for the whole batch instead
+    of one per job — used when a pipeline run materializes all of its
+    step jobs at once.
+    """
+    ts = now_iso()
+    rows = [
+        (r["job_id"], r["repo_url"], r["task"], r.get("user_id", ""), ts,
+         r.get("pipeline_id"), r.get("run_id"), r.get("batch_id"),
+         r.get("step_name"), r.get("step_index"))
+        for r in records
+    ]
+    with get_db() as conn:
+        conn.executemany(
+            """INSERT INTO jobs
+               (job_id, repo_url, task, submitted_by, submitted_at,
+                pipeline_id, run_id, batch_id, step_name, step_index, logs_json)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '[]')""",
+            rows,
         )
-    return get_job(job_id)
 
 
 def get_job(job_id: str) -> Optional[dict]:
-    """Fetch a single job by ID."""
-    with get_db() as conn:
+    """
+    Fetch a single job by ID, including its most recent log lines.
+
+    Embedded logs are capped at MAX_RESULT_LOGS so long-running jobs
+    return bounded payloads; page older lines via get_job_logs.
+    """
+    with get_db(readonly=True) as conn:
         row = conn.execute(
             "SELECT * FROM jobs WHERE job_id = ?", (job_id,)
         ).fetchone()
-    return _row_to_dict(row) if row else None
+        if not row:
+            return None
+        log_rows = conn.execute(
+            """SELECT line FROM (
+                   SELECT seq, line FROM job_logs
+                   WHERE job_id = ? ORDER BY seq DESC LIMIT ?
+               ) ORDER BY seq""",
+            (job_id, MAX_RESULT_LOGS),
+        ).fetchall()
+    record = _job_row_to_dict(row)
+    if log_rows:
+        record["logs"] = [r["line"] for r in log_rows]
+    # else: legacy rows keep their logs from the jobs.logs_json column
+    return record
 
 
-def update_job(job_id: str, **fields) -> Optional[dict]:
-    """Update specific fields on a job record."""
+def get_job_status(job_id: str) -> Optional[dict]:
+    """
+    Fetch only the columns /status needs.
+
+    The full get_job pulls and parses the result and logs blobs; polling
+    dashboards hit /status constantly, so this stays scalar-only.
+    """
+    with get_db(readonly=True) as conn:
+        row = conn.execute(
+            """SELECT job_id, status, submitted_at, started_at, completed_at
+               FROM jobs WHERE job_id = ?""",
+            (job_id,),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def append_job_logs(job_id: str, lines: list[str]) -> int:
+    """
+    Append log lines as individual job_logs rows.
+
+    Returns the total number of lines stored for the job afterwards.
+    Each line gets a monotonically increasing seq, so readers can fetch
+    only lines they have not seen yet via get_job_logs(since_seq=...).
+    """
+    if not lines:
+        # Still report the real stored count — callers track it as a
+        # cursor into what is already persisted, and a literal 0 here
+        # would make the next append re-write the job's entire history.
+        with get_db(readonly=True) as conn:
+            row = conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) + 1 FROM job_logs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        return row[0]
+    ts = now_iso()
+    with get_db() as conn:
+        next_seq = conn.execute(
+            "SELECT COALESCE(MAX(seq), -1) + 1 FROM job_logs WHERE job_id = ?",
+            (job_id,),
+        ).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO job_logs (job_id, seq, ts, line) VALUES (?, ?, ?, ?)",
+            [(job_id, next_seq + i, ts, line) for i, line in enumerate(lines)],
+        )
+    return next_seq + len(lines)
+
+
+def get_job_logs(job_id: str, since_seq: int = 0, limit: Optional[int] = None) -> list[dict]:
+    """Return log rows with seq >= since_seq, oldest first."""
+    with get_db(readonly=True) as conn:
+        if limit is not None:
+            rows = conn.execute(
+                """SELECT seq, ts, line FROM job_logs
+                   WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?""",
+                (job_id, since_seq, limit),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                """SELECT seq, ts, line FROM job_logs
+                   WHERE job_id = ? AND seq >= ? ORDER BY seq""",
+                (job_id, since_seq),
+            ).fetchall()
+    return [dict(r) for r in rows]
+
+
+@functools.lru_cache(maxsize=128)
+def _job_set_clause(cols: tuple) -> str:
+    """SET clause for a canonical (sorted) column tuple.
+
+    Caching it means a given field combination always yields the exact
+    same UPDATE text, so the statement hits sqlite3's per-connection
+    prepared-statement cache instead of being re-parsed and re-planned.
+    """
+    return ", ".join(f"{c} = ?" for c in cols)
+
+
+def _normalize_job_fields(fields: dict) -> tuple[str, list]:
+    """Serialize structured fields and build the SET clause + values."""
     if "result" in fields:
-        fields["result_json"] = json.dumps(fields.pop("result"))
+        fields["result_json"] = orjson.dumps(fields.pop("result")).decode()
     if "logs" in fields:
-        fields["logs_json"] = json.dumps(fields.pop("logs"))
+        fields["logs_json"] = orjson.dumps(fields.pop("logs")).decode()
     if "step_output" in fields:
-        fields["step_output_json"] = json.dumps(fields.pop("step_output"))
+        fields["step_output_json"] = orjson.dumps(fields.pop("step_output")).decode()
 
     fields["updated_at"] = now_iso()
 
-    set_clause = ", ".join(f"{k} = ?" for k in fields)
-    values = list(fields.values()) + [job_id]
+    cols = tuple(sorted(fields))
+    return _job_set_clause(cols), [fields[c] for c in cols]
+
+
+def _apply_job_update(conn: sqlite3.Connection, job_id: str, fields: dict) -> None:
+    """Run the UPDATE for update_job_async's background writer."""
+    set_clause, values = _normalize_job_fields(fields)
+    conn.execute(
+        f"UPDATE jobs SET {set_clause} WHERE job_id = ?",
+        values + [job_id],
+    )
 
+
+def update_job(job_id: str, **fields) -> Optional[dict]:
+    """Update specific fields on a job record.
+
+    Returns the updated row via UPDATE ... RETURNING — one statement
+    instead of an UPDATE plus a follow-up SELECT. The returned record
+    carries only the legacy logs_json column; use get_job for a record
+    with the job_logs lines embedded.
+    """
+    set_clause, values = _normalize_job_fields(fields)
     with get_db() as conn:
-        conn.execute(
-            f"UPDATE jobs SET {set_clause} WHERE job_id = ?",
-            values,
-        )
-    return get_job(job_id)
+        row = conn.execute(
+            f"UPDATE jobs SET {set_clause} WHERE job_id = ? RETURNING *",
+            values + [job_id],
+        ).fetchone()
+    return _job_row_to_dict(row) if row else None
+
+
+# Bounded queue + daemon writer thread: progress updates from the agent
+# loop become a put_nowait-ish enqueue instead of a synchronous SQLite
+# write, and the drainer batches whatever has piled up into one
+# transaction. Terminal updates should stay synchronous (or be followed
+# by flush_job_updates) so completion is never left in the queue.
+_write_queue: "queue.Queue[tuple[str, dict]]" = queue.Queue(maxsize=1024)
+_writer_thread: Optional[threading.Thread] = None
+_writer_thread_lock = threading.Lock()
+_WRITE_BATCH_MAX = 64
+
+
+def _drain_writes() -> None:
+    while True:
+        batch = [_write_queue.get()]
+        while len(batch) < _WRITE_BATCH_MAX:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            with get_db() as conn:
+                for job_id, fields in batch:
+                    _apply_job_update(conn, job_id, fields)
+        except Exception as exc:
+            print(f"[DB] Background job update failed: {exc}")
+        finally:
+            for _ in batch:
+                _write_queue.task_done()
+
+
+def update_job_async(job_id: str, **fields) -> None:
+    """
+    Queue a job update for the background writer thread.
+
+    Blocks only if the queue is full (back-pressure), never on SQLite.
+    """
+    global _writer_thread
+    with _writer_thread_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_drain_writes, daemon=True)
+            _writer_thread.start()
+    _write_queue.put((job_id, fields))
+
+
+def flush_job_updates() -> None:
+    """Block until every queued job update has been written."""
+    if _writer_thread is not None:
+        _write_queue.join()
 
 
 def list_jobs(limit: int = 100, offset: int = 0) -> list[dict]:
     """Return jobs newest-first with pagination."""
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         rows = conn.execute(
             "SELECT * FROM jobs ORDER BY submitted_at DESC LIMIT ? OFFSET ?",
             (limit, offset),
         ).fetchall()
-    return [_row_to_dict(r) for r in rows]
+    return [_job_row_to_dict(r) for r in rows]
+
+
+def list_job_summaries(limit: int = 100, offset: int = 0) -> list[dict]:
+    """
+    Return the /jobs listing projection straight from SQL, newest first.
+
+    Selects only the summary columns (task truncated, pr_url extracted
+    from the result JSON), so log and result blobs never leave SQLite.
+    """
+    with get_db(readonly=True) as conn:
+        rows = conn.execute(
+            """SELECT job_id, status, repo_url, substr(task, 1, 100) AS task,
+                      submitted_by, submitted_at, started_at, completed_at,
+                      json_extract(result_json, '$.pr_url') AS pr_url
+               FROM jobs ORDER BY submitted_at DESC LIMIT ? OFFSET ?""",
+            (limit, offset),
+        ).fetchall()
+    return [dict(r) for r in rows]
 
 
 def get_jobs_for_run(run_id: str) -> list[dict]:
     """Return all jobs belonging to a pipeline run, ordered by step_index."""
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         rows = conn.execute(
             "SELECT * FROM jobs WHERE run_id = ? ORDER BY step_index",
             (run_id,),
         ).fetchall()
-    return [_row_to_dict(r) for r in rows]
+    return [_job_row_to_dict(r) for r in rows]
+
+
+def maintain_db() -> None:
+    """
+    Periodic database maintenance: checkpoint, refresh stats, optimize.
+
+    DELETEs from cleanup_old_jobs leave free pages behind and let the
+    planner's statistics drift; without ANALYZE the composite indexes
+    may never be chosen. Meant to run on a schedule (see
+    db_maintenance in api.py), not on the request path.
+    """
+    with get_db() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
 
 
 def cleanup_old_jobs(days: int = 30) -> int:
-    """Delete completed/failed jobs older than `days`. Returns count deleted."""
+    """Delete completed/failed jobs older than `days`. Returns count deleted.
+
+    Log lines are pruned in the same transaction — job_logs is the bulk
+    of the data, and rows orphaned by a jobs-only delete would otherwise
+    accumulate forever.
+    """
     with get_db() as conn:
-        cursor = conn.execute(
+        rows = conn.execute(
             """DELETE FROM jobs
                WHERE status IN ('completed', 'failed')
-               AND completed_at < datetime('now', ?)""",
+               AND completed_at < datetime('now', ?)
+               RETURNING job_id""",
             (f"-{days} days",),
-        )
-    return cursor.rowcount
+        ).fetchall()
+        if rows:
+            conn.executemany(
+                "DELETE FROM job_logs WHERE job_id = ?",
+                [(r["job_id"],) for r in rows],
+            )
+    return len(rows)
 
 
 # ---------------------------------------------------------------------------
 # Pipeline CRUD
 # ---------------------------------------------------------------------------
 
-def create_pipeline(pipeline_id: str, name: str, repo_url: str, steps: list) -> dict:
-    """Create a new pipeline definition."""
+def create_pipeline(
+    pipeline_id: str,
+    name: str,
+    repo_url: str,
+    steps: list,
+    layers: Optional[list] = None,
+) -> dict:
+    """Create a new pipeline definition.
+
+    *layers* is the topologically sorted execution plan; persisting it at
+    creation time lets runs skip re-sorting a DAG that never changes.
+    """
     with get_db() as conn:
-        conn.execute(
-            """INSERT INTO pipelines (pipeline_id, name, repo_url, steps_json)
-               VALUES (?, ?, ?, ?)""",
-            (pipeline_id, name, repo_url, json.dumps(steps)),
-        )
-    return get_pipeline(pipeline_id)
+        row = conn.execute(
+            """INSERT INTO pipelines (pipeline_id, name, repo_url, steps_json, layers_json)
+               VALUES (?, ?, ?, ?, ?)
+               RETURNING *""",
+            (pipeline_id, name, repo_url, orjson.dumps(steps).decode(),
+             orjson.dumps(layers).decode() if layers is not None else None),
+        ).fetchone()
+    return _pipeline_row_to_dict(row)
 
 
 def get_pipeline(pipeline_id: str) -> Optional[dict]:
     """Fetch a pipeline definition by ID."""
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         row = conn.execute(
             "SELECT * FROM pipelines WHERE pipeline_id = ?", (pipeline_id,)
         ).fetchone()
-    return _row_to_dict(row) if row else None
+    return _pipeline_row_to_dict(row) if row else None
 
 
 def list_pipelines() -> list[dict]:
     """Return all pipeline definitions."""
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         rows = conn.execute(
             "SELECT * FROM pipelines ORDER BY created_at DESC"
         ).fetchall()
-    return [_row_to_dict(r) for r in rows]
+    return [_pipeline_row_to_dict(r) for r in rows]
 
 
 def delete_pipeline(pipeline_id: str) -> bool:
@@ -290,21 +828,22 @@ def delete_pipeline(pipeline_id: str) -> bool:
 def create_pipeline_run(run_id: str, pipeline_id: str, repo_url: str) -> dict:
     """Create a new pipeline run record."""
     with get_db() as conn:
-        conn.execute(
+        row = conn.execute(
             """INSERT INTO pipeline_runs (run_id, pipeline_id, repo_url)
-               VALUES (?, ?, ?)""",
+               VALUES (?, ?, ?)
+               RETURNING *""",
             (run_id, pipeline_id, repo_url),
-        )
-    return get_pipeline_run(run_id)
+        ).fetchone()
+    return dict(row)
 
 
 def get_pipeline_run(run_id: str) -> Optional[dict]:
     """Fetch a pipeline run by ID."""
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         row = conn.execute(
             "SELECT * FROM pipeline_runs WHERE run_id = ?", (run_id,)
         ).fetchone()
-    return _row_to_dict(row) if row else None
+    return dict(row) if row else None  # pipeline_runs has no JSON columns
 
 
 def update_pipeline_run(run_id: str, **fields) -> Optional[dict]:
@@ -313,16 +852,16 @@ def update_pipeline_run(run_id: str, **fields) -> Optional[dict]:
     set_clause = ", ".join(f"{k} = ?" for k in fields)
     values = list(fields.values()) + [run_id]
     with get_db() as conn:
-        conn.execute(
-            f"UPDATE pipeline_runs SET {set_clause} WHERE run_id = ?",
+        row = conn.execute(
+            f"UPDATE pipeline_runs SET {set_clause} WHERE run_id = ? RETURNING *",
             values,
-        )
-    return get_pipeline_run(run_id)
+        ).fetchone()
+    return dict(row) if row else None
 
 
 def list_pipeline_runs(pipeline_id: Optional[str] = None) -> list[dict]:
     """Return pipeline runs, optionally filtered by pipeline_id."""
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         if pipeline_id:
             rows = conn.execute(
                 "SELECT * FROM pipeline_runs WHERE pipeline_id = ? ORDER BY created_at DESC",
@@ -332,4 +871,4 @@ def list_pipeline_runs(pipeline_id: Optional[str] = None) -> list[dict]:
             rows = conn.execute(
                 "SELECT * FROM pipeline_runs ORDER BY created_at DESC"
             ).fetchall()
-    return [_row_to_dict(r) for r in rows]
+    return [dict(r) for r in rows]
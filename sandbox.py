@@ -8,7 +8,10 @@ Usage:
 import modal
 import os
 
-from shared import sandbox_image, setup_github_auth, clone_and_install, run_agent
+from shared import (
+    sandbox_image, setup_github_auth, clone_and_install, run_agent,
+    repo_cache_volume, REPO_CACHE_DIR,
+)
 
 app = modal.App("agent-in-the-cloud")
 
@@ -19,6 +22,7 @@ app = modal.App("agent-in-the-cloud")
 @app.function(
     image=sandbox_image,
     timeout=1800,
+    volumes={REPO_CACHE_DIR: repo_cache_volume},
     secrets=[
         modal.Secret.from_dict({
             "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", ""),
@@ -8,6 +8,7 @@ pipeline DAG structure.
 The actual execution orchestration lives in api.py's run_pipeline_task.
 """
 
+import functools
 import re
 from collections import deque
 
@@ -19,6 +20,28 @@ from collections import deque
 _TEMPLATE_RE = re.compile(r"\{\{\s*steps\.(\w+)\.output\.(\w+)\s*\}\}")
 
 
+@functools.lru_cache(maxsize=256)
+def _parse_template(text: str) -> tuple:
+    """
+    Split a template string into literal chunks and placeholder references.
+
+    Returns a tuple whose items are either plain strings or
+    (step_name, key, raw_placeholder) triples. Task strings are immutable
+    per pipeline, so the parse is cached — retries and re-runs only pay
+    for rendering, not re-scanning.
+    """
+    parts: list = []
+    pos = 0
+    for match in _TEMPLATE_RE.finditer(text):
+        if match.start() > pos:
+            parts.append(text[pos:match.start()])
+        parts.append((match.group(1), match.group(2), match.group(0)))
+        pos = match.end()
+    if pos < len(text):
+        parts.append(text[pos:])
+    return tuple(parts)
+
+
 def resolve_templates(text: str, step_outputs: dict[str, dict]) -> str:
     """
     Replace {{steps.<name>.output.<key>}} placeholders with actual values.
@@ -29,21 +52,37 @@ def resolve_templates(text: str, step_outputs: dict[str, dict]) -> str:
 
     Returns the resolved string. Missing references are left as-is.
     """
-    def _replace(match: re.Match) -> str:
-        step_name = match.group(1)
-        key = match.group(2)
-        output = step_outputs.get(step_name, {})
-        value = output.get(key)
-        return str(value) if value is not None else match.group(0)
-
-    return _TEMPLATE_RE.sub(_replace, text)
+    parts = _parse_template(text)
+    if not any(isinstance(p, tuple) for p in parts):
+        return text  # no placeholders — nothing to render
+
+    # Stringify each distinct reference once: the same placeholder often
+    # repeats within a prompt, and there is no reason to re-render it
+    # per occurrence.
+    rendered = []
+    seen: dict[tuple, str] = {}
+    for part in parts:
+        if isinstance(part, str):
+            rendered.append(part)
+            continue
+        step_name, key, raw = part
+        ref = (step_name, key)
+        text_value = seen.get(ref)
+        if text_value is None:
+            value = step_outputs.get(step_name, {}).get(key)
+            text_value = str(value) if value is not None else raw
+            seen[ref] = text_value
+        rendered.append(text_value)
+    return "".join(rendered)
 
 
 # ---------------------------------------------------------------------------
 # 2. DAG validation and topological sort
 # ---------------------------------------------------------------------------
 
-def _build_graph(steps: list[dict]) -> tuple[dict[str, list[str]], dict[str, int]]:
+def _build_graph(
+    steps: list[dict],
+) -> tuple[dict[str, list[str]], dict[str, int]]:
     """
     Build adjacency list and in-degree map from step definitions.
 
@@ -56,18 +95,25 @@ def _build_graph(steps: list[dict]) -> tuple[dict[str, list[str]], dict[str, int
         adjacency[parent] = [children that depend on parent]
         in_degree[name] = number of unresolved dependencies
     """
-    names = {s["name"] for s in steps}
-    adjacency: dict[str, list[str]] = {s["name"]: [] for s in steps}
-    in_degree: dict[str, int] = {s["name"]: 0 for s in steps}
+    adjacency: dict[str, list[str]] = {}
+    in_degree: dict[str, int] = {}
+    for step in steps:
+        name = step["name"]
+        adjacency[name] = []
+        in_degree[name] = 0
 
+    # Dependency wiring validates against in_degree directly — the maps
+    # built above double as the known-name set, so no separate set is
+    # collected.
     for step in steps:
+        name = step["name"]
         for dep in step.get("depends_on", []):
-            if dep not in names:
+            if dep not in in_degree:
                 raise ValueError(
-                    f"Step '{step['name']}' depends on unknown step '{dep}'"
+                    f"Step '{name}' depends on unknown step '{dep}'"
                 )
-            adjacency[dep].append(step["name"])
-            in_degree[step["name"]] += 1
+            adjacency[dep].append(name)
+            in_degree[name] += 1
 
     return adjacency, in_degree
 
@@ -102,6 +148,13 @@ def topological_sort(steps: list[dict]) -> list[list[str]]:
         queue = next_queue
 
     if visited != len(in_degree):
-        raise ValueError("Pipeline contains a cycle — cannot schedule")
+        # The BFS stalls the moment every remaining node still has an
+        # unresolved dependency — those are exactly the cycle members
+        # (plus their downstream), so name them for the error.
+        stuck = sorted(n for n, deg in in_degree.items() if deg > 0)
+        raise ValueError(
+            "Pipeline contains a cycle — cannot schedule "
+            f"(involving: {', '.join(stuck)})"
+        )
 
     return layers